@@ -44,6 +44,9 @@ from .util import (
     install_jax,
     is_jax_compatible,
     have_julia,
+    have_numba,
+    have_cython,
+    have_symengine,
 )
 from .logger import logger, set_logging_level
 from .logger import logger, set_logging_level, get_new_logger
@@ -84,6 +87,10 @@ from .expression_tree.operations.evaluate_python import (
 )
 
 from .expression_tree.operations.evaluate_python import EvaluatorJax
+from .expression_tree.operations.evaluate_python import EvaluatorNumba
+from .expression_tree.operations.evaluate_python import EvaluatorCython
+from .expression_tree.operations.evaluate_python import EvaluatorSymEngine
+from .expression_tree.operations.evaluate_python import EVALUATORS
 from .expression_tree.operations.evaluate_python import JaxCooMatrix
 
 from .expression_tree.operations.jacobian import Jacobian
@@ -1,11 +1,21 @@
 #
 # Write a symbol to python
 #
+import functools
+import hashlib
+import importlib.util
+import marshal
 import numbers
-from collections import OrderedDict
+import operator
+import os
+import pickle
+import re
+import sys
+import tempfile
 
 import numpy as np
 import scipy.sparse
+from scipy import special
 
 import pybamm
 
@@ -15,6 +25,12 @@ if pybamm.have_jax():
 
     config.update("jax_enable_x64", True)
 
+if pybamm.have_numba():
+    import numba
+
+if pybamm.have_symengine():
+    import symengine
+
 
 class JaxCooMatrix:
     """
@@ -107,19 +123,20 @@ def create_jax_coo_matrix(value):
     return JaxCooMatrix(row, col, data, value.shape)
 
 
+# the cache is bounded, as ids from every expression tree converted in a session
+# (e.g. in a parameter sweep) would otherwise be kept for good
+@functools.lru_cache(maxsize=2**16)
 def id_to_python_variable(symbol_id, constant=False):
     """
     This function defines the format for the python variable names used in find_symbols
     and to_python. Variable names are based on a nodes' id to make them unique
     """
-
+    # ids are 64 bit hashes, which can be negative. Writing their two's complement in
+    # hex gives a unique valid python variable name for each id
     if constant:
-        var_format = "const_{:05d}"
+        return "const_{:016x}".format(symbol_id & 0xFFFFFFFFFFFFFFFF)
     else:
-        var_format = "var_{:05d}"
-
-    # Need to replace "-" character to make them valid python variable names
-    return var_format.format(symbol_id).replace("-", "m")
+        return "var_{:016x}".format(symbol_id & 0xFFFFFFFFFFFFFFFF)
 
 
 def is_scalar(arg):
@@ -130,6 +147,18 @@ def is_scalar(arg):
         return np.all(np.array(arg.shape) == 1)
 
 
+def is_sparse(symbol):
+    """
+    Returns True if the symbol evaluates to a scipy sparse matrix. This is a static
+    property of each subtree: state vectors and time are always dense, and the result
+    for all other nodes is found (once, and then cached) from the evaluation of the
+    node for its shape, see :meth:`pybamm.Symbol.evaluate_for_shape()`
+    """
+    if isinstance(symbol, (pybamm.StateVector, pybamm.Time)):
+        return False
+    return scipy.sparse.issparse(symbol.evaluate_for_shape())
+
+
 def find_symbols(symbol, constant_symbols, variable_symbols, output_jax=False):
     """
     This function converts an expression tree to a dictionary of node id's and strings
@@ -140,20 +169,21 @@ def find_symbols(symbol, constant_symbols, variable_symbols, output_jax=False):
     pybamm.StateVector). The former are put in `constant_symbols`, the latter in
     `variable_symbols`
 
-    Note that it is important that the arguments `constant_symbols` and
-    `variable_symbols` be an *ordered* dict, since the final ordering of the code lines
-    are important for the calculations. A dict is specified rather than a list so that
-    identical subtrees (which give identical id's) are not recalculated in the code
+    Note that the final ordering of the code lines is important for the
+    calculations, and relies on the arguments `constant_symbols` and
+    `variable_symbols` being dicts, which keep their insertion order. A dict is
+    specified rather than a list so that identical subtrees (which give identical id's)
+    are not recalculated in the code
 
     Parameters
     ----------
     symbol : :class:`pybamm.Symbol`
         The symbol or expression tree to convert
 
-    constant_symbol: collections.OrderedDict
+    constant_symbol: dict
         The output dictionary of constant symbol ids to lines of code
 
-    variable_symbol: collections.OrderedDict
+    variable_symbol: dict
         The output dictionary of variable (with y or t) symbol ids to lines of code
 
     output_jax: bool
@@ -161,6 +191,27 @@ def find_symbols(symbol, constant_symbols, variable_symbols, output_jax=False):
         raises NotImplNotImplementedError if any SparseStack or Mat-Mat multiply
         operations are used
 
+    """
+    # visit the tree in post-order (children before their parents) with an explicit
+    # stack rather than recursion. Children are pushed in reverse so that they are
+    # visited in order, and subtrees that have already been converted are skipped
+    stack = [(symbol, False)]
+    while stack:
+        node, children_found = stack.pop()
+        if node.id in variable_symbols or node.id in constant_symbols:
+            continue
+        if children_found or node.is_constant():
+            node_to_python(node, constant_symbols, variable_symbols, output_jax)
+        else:
+            stack.append((node, True))
+            stack.extend((child, False) for child in reversed(node.children))
+
+
+def node_to_python(symbol, constant_symbols, variable_symbols, output_jax=False):
+    """
+    Converts a single node of an expression tree to python code, and adds it to
+    `constant_symbols` or `variable_symbols`, assuming that all its children have
+    already been converted. See :func:`find_symbols` for the parameters
     """
     # constant symbols that are not numbers are stored in a list of constants, which are
     # passed into the generated function constant symbols that are numbers are written
@@ -176,209 +227,322 @@ def find_symbols(symbol, constant_symbols, variable_symbols, output_jax=False):
                 constant_symbols[symbol.id] = value
         return
 
-    # process children recursively
-    for child in symbol.children:
-        find_symbols(child, constant_symbols, variable_symbols, output_jax)
-
     # calculate the variable names that will hold the result of calculating the
     # children variables
     children_vars = []
     for child in symbol.children:
         if child.is_constant():
-            child_eval = child.evaluate()
-            if isinstance(child_eval, numbers.Number):
-                children_vars.append(str(child_eval))
-            else:
+            # constant children have already been converted, so any value that is not
+            # a number does not need to be evaluated again
+            if child.id in constant_symbols:
                 children_vars.append(id_to_python_variable(child.id, True))
+            else:
+                children_vars.append(str(child.evaluate()))
         else:
             children_vars.append(id_to_python_variable(child.id, False))
 
-    if isinstance(symbol, pybamm.BinaryOperator):
-        # Multiplication and Division need special handling for scipy sparse matrices
-        # TODO: we can pass through a dummy y and t to get the type and then hardcode
-        # the right line, avoiding these checks
-        if isinstance(symbol, pybamm.Multiplication):
-            dummy_eval_left = symbol.children[0].evaluate_for_shape()
-            dummy_eval_right = symbol.children[1].evaluate_for_shape()
-            if scipy.sparse.issparse(dummy_eval_left):
-                if output_jax and is_scalar(dummy_eval_right):
-                    symbol_str = "{0}.scalar_multiply({1})".format(
-                        children_vars[0], children_vars[1]
-                    )
-                else:
-                    symbol_str = "{0}.multiply({1})".format(
-                        children_vars[0], children_vars[1]
-                    )
-            elif scipy.sparse.issparse(dummy_eval_right):
-                if output_jax and is_scalar(dummy_eval_left):
-                    symbol_str = "{1}.scalar_multiply({0})".format(
-                        children_vars[0], children_vars[1]
-                    )
-                else:
-                    symbol_str = "{1}.multiply({0})".format(
-                        children_vars[0], children_vars[1]
-                    )
-            else:
-                symbol_str = "{0} * {1}".format(children_vars[0], children_vars[1])
-        elif isinstance(symbol, pybamm.Division):
-            dummy_eval_left = symbol.children[0].evaluate_for_shape()
-            dummy_eval_right = symbol.children[1].evaluate_for_shape()
-            if scipy.sparse.issparse(dummy_eval_left):
-                if output_jax and is_scalar(dummy_eval_right):
-                    symbol_str = "{0}.scalar_multiply(1/{1})".format(
-                        children_vars[0], children_vars[1]
-                    )
-                else:
-                    symbol_str = "{0}.multiply(1/{1})".format(
-                        children_vars[0], children_vars[1]
-                    )
-            else:
-                symbol_str = "{0} / {1}".format(children_vars[0], children_vars[1])
-
-        elif isinstance(symbol, pybamm.Inner):
-            dummy_eval_left = symbol.children[0].evaluate_for_shape()
-            dummy_eval_right = symbol.children[1].evaluate_for_shape()
-            if scipy.sparse.issparse(dummy_eval_left):
-                if output_jax and is_scalar(dummy_eval_right):
-                    symbol_str = "{0}.scalar_multiply({1})".format(
-                        children_vars[0], children_vars[1]
-                    )
-                else:
-                    symbol_str = "{0}.multiply({1})".format(
-                        children_vars[0], children_vars[1]
-                    )
-            elif scipy.sparse.issparse(dummy_eval_right):
-                if output_jax and is_scalar(dummy_eval_left):
-                    symbol_str = "{1}.scalar_multiply({0})".format(
-                        children_vars[0], children_vars[1]
-                    )
-                else:
-                    symbol_str = "{1}.multiply({0})".format(
-                        children_vars[0], children_vars[1]
-                    )
-            else:
-                symbol_str = "{0} * {1}".format(children_vars[0], children_vars[1])
-
-        elif isinstance(symbol, pybamm.Minimum):
-            symbol_str = "np.minimum({},{})".format(children_vars[0], children_vars[1])
-        elif isinstance(symbol, pybamm.Maximum):
-            symbol_str = "np.maximum({},{})".format(children_vars[0], children_vars[1])
-
-        elif isinstance(symbol, pybamm.MatrixMultiplication):
-            dummy_eval_left = symbol.children[0].evaluate_for_shape()
-            dummy_eval_right = symbol.children[1].evaluate_for_shape()
-            if output_jax and (
-                scipy.sparse.issparse(dummy_eval_left)
-                and scipy.sparse.issparse(dummy_eval_right)
-            ):
-                raise NotImplementedError(
-                    "sparse mat-mat multiplication not supported "
-                    "for output_jax == True"
-                )
-            else:
-                symbol_str = (
-                    children_vars[0] + " " + symbol.name + " " + children_vars[1]
-                )
-        else:
-            symbol_str = children_vars[0] + " " + symbol.name + " " + children_vars[1]
+    emitter = EMITTERS_BY_TYPE.get(type(symbol))
+    if emitter is None:
+        emitter = find_emitter(symbol)
+    variable_symbols[symbol.id] = emitter(
+        symbol, children_vars, constant_symbols, output_jax
+    )
 
-    elif isinstance(symbol, pybamm.UnaryOperator):
-        # Index has a different syntax than other univariate operations
-        if isinstance(symbol, pybamm.Index):
-            symbol_str = "{}[{}:{}]".format(
-                children_vars[0], symbol.slice.start, symbol.slice.stop
-            )
-        else:
-            symbol_str = symbol.name + children_vars[0]
 
-    elif isinstance(symbol, pybamm.Function):
-        children_str = ""
-        for child_var in children_vars:
-            if children_str == "":
-                children_str = child_var
-            else:
-                children_str += ", " + child_var
-        if isinstance(symbol.function, np.ufunc):
-            # write any numpy functions directly
-            symbol_str = "np.{}({})".format(symbol.function.__name__, children_str)
-        else:
-            # unknown function, store it as a constant and call this in the
-            # generated code
-            constant_symbols[symbol.id] = symbol.function
-            funct_var = id_to_python_variable(symbol.id, True)
-            symbol_str = "{}({})".format(funct_var, children_str)
-
-    elif isinstance(symbol, pybamm.Concatenation):
-
-        # no need to concatenate if there is only a single child
-        if isinstance(symbol, pybamm.NumpyConcatenation):
-            if len(children_vars) == 1:
-                symbol_str = children_vars[0]
-            else:
-                symbol_str = "np.concatenate(({}))".format(",".join(children_vars))
+# The functions below write the python code for a single (non-constant) node, given
+# the python code for its children, see :func:`node_to_python`
 
-        elif isinstance(symbol, pybamm.SparseStack):
-            if len(children_vars) == 1:
-                symbol_str = children_vars[0]
-            else:
-                if output_jax:
-                    raise NotImplementedError
-                else:
-                    symbol_str = "scipy.sparse.vstack(({}))".format(
-                        ",".join(children_vars)
-                    )
-
-        # DomainConcatenation specifies a particular ordering for the concatenation,
-        # which we must follow
-        elif isinstance(symbol, pybamm.DomainConcatenation):
-            slice_starts = []
-            all_child_vectors = []
-            for i in range(symbol.secondary_dimensions_npts):
-                child_vectors = []
-                for child_var, slices in zip(children_vars, symbol._children_slices):
-                    for child_dom, child_slice in slices.items():
-                        slice_starts.append(symbol._slices[child_dom][i].start)
-                        child_vectors.append(
-                            "{}[{}:{}]".format(
-                                child_var, child_slice[i].start, child_slice[i].stop
-                            )
-                        )
-                all_child_vectors.extend(
-                    [v for _, v in sorted(zip(slice_starts, child_vectors))]
+
+def multiplication_to_python(symbol, children_vars, constant_symbols, output_jax):
+    # Multiplication and Division need special handling for scipy sparse matrices.
+    # Whether a child is sparse is known when the code is generated, so only the
+    # line for the right combination of sparse and dense children is written
+    left, right = children_vars
+    if is_sparse(symbol.left):
+        if output_jax and is_scalar(symbol.right.evaluate_for_shape()):
+            return f"{left}.scalar_multiply({right})"
+        return f"{left}.multiply({right})"
+    elif is_sparse(symbol.right):
+        if output_jax and is_scalar(symbol.left.evaluate_for_shape()):
+            return f"{right}.scalar_multiply({left})"
+        return f"{right}.multiply({left})"
+    return f"{left} * {right}"
+
+
+def division_to_python(symbol, children_vars, constant_symbols, output_jax):
+    left, right = children_vars
+    if is_sparse(symbol.left):
+        if output_jax and is_scalar(symbol.right.evaluate_for_shape()):
+            return f"{left}.scalar_multiply(1/{right})"
+        return f"{left}.multiply(1/{right})"
+    return f"{left} / {right}"
+
+
+def minimum_to_python(symbol, children_vars, constant_symbols, output_jax):
+    left, right = children_vars
+    return f"np.minimum({left},{right})"
+
+
+def maximum_to_python(symbol, children_vars, constant_symbols, output_jax):
+    left, right = children_vars
+    return f"np.maximum({left},{right})"
+
+
+def matrix_multiplication_to_python(
+    symbol, children_vars, constant_symbols, output_jax
+):
+    if output_jax and is_sparse(symbol.left) and is_sparse(symbol.right):
+        raise NotImplementedError(
+            "sparse mat-mat multiplication not supported for output_jax == True"
+        )
+    return binary_operator_to_python(
+        symbol, children_vars, constant_symbols, output_jax
+    )
+
+
+def binary_operator_to_python(symbol, children_vars, constant_symbols, output_jax):
+    left, right = children_vars
+    return f"{left} {symbol.name} {right}"
+
+
+def index_to_python(symbol, children_vars, constant_symbols, output_jax):
+    return f"{children_vars[0]}[{symbol.slice.start}:{symbol.slice.stop}]"
+
+
+def unary_operator_to_python(symbol, children_vars, constant_symbols, output_jax):
+    return symbol.name + children_vars[0]
+
+
+def function_to_python(symbol, children_vars, constant_symbols, output_jax):
+    children_str = ", ".join(children_vars)
+    if isinstance(symbol.function, np.ufunc):
+        # write any numpy functions directly
+        return f"np.{symbol.function.__name__}({children_str})"
+    # unknown function, store it as a constant and call this in the generated code
+    constant_symbols[symbol.id] = symbol.function
+    funct_var = id_to_python_variable(symbol.id, True)
+    return f"{funct_var}({children_str})"
+
+
+def numpy_concatenation_to_python(symbol, children_vars, constant_symbols, output_jax):
+    # no need to concatenate if there is only a single child, whose variable is then
+    # used in place of this one (see inline_variables)
+    if len(children_vars) == 1:
+        return children_vars[0]
+    return f"np.concatenate(({','.join(children_vars)}))"
+
+
+def sparse_stack_to_python(symbol, children_vars, constant_symbols, output_jax):
+    if len(children_vars) == 1:
+        return children_vars[0]
+    if output_jax:
+        raise NotImplementedError
+    return f"scipy.sparse.vstack(({','.join(children_vars)}))"
+
+
+def domain_concatenation_to_python(symbol, children_vars, constant_symbols, output_jax):
+    # DomainConcatenation specifies a particular ordering for the concatenation,
+    # which we must follow
+    if len(children_vars) == 1 and symbol.secondary_dimensions_npts == 1:
+        return children_vars[0]
+    slice_starts = []
+    all_child_vectors = []
+    for i in range(symbol.secondary_dimensions_npts):
+        child_vectors = []
+        for child_var, slices in zip(children_vars, symbol._children_slices):
+            for child_dom, child_slice in slices.items():
+                slice_starts.append(symbol._slices[child_dom][i].start)
+                child_vectors.append(
+                    f"{child_var}[{child_slice[i].start}:{child_slice[i].stop}]"
                 )
-            if len(children_vars) > 1 or symbol.secondary_dimensions_npts > 1:
-                symbol_str = "np.concatenate(({}))".format(",".join(all_child_vectors))
-            else:
-                symbol_str = "{}".format(",".join(children_vars))
-        else:
-            raise NotImplementedError
+        all_child_vectors.extend(
+            [v for _, v in sorted(zip(slice_starts, child_vectors))]
+        )
+    return f"np.concatenate(({','.join(all_child_vectors)}))"
+
+
+def concatenation_to_python(symbol, children_vars, constant_symbols, output_jax):
+    raise NotImplementedError
 
+
+def state_vector_to_python(symbol, children_vars, constant_symbols, output_jax):
     # Note: we assume that y is being passed as a column vector
-    elif isinstance(symbol, pybamm.StateVector):
-        indices = np.argwhere(symbol.evaluation_array).reshape(-1).astype(np.int32)
-        consecutive = np.all(indices[1:] - indices[:-1] == 1)
-        if len(indices) == 1 or consecutive:
-            symbol_str = "y[{}:{}]".format(indices[0], indices[-1] + 1)
+    indices = np.argwhere(symbol.evaluation_array).reshape(-1).astype(np.int32)
+    consecutive = np.all(indices[1:] - indices[:-1] == 1)
+    if len(indices) == 1 or consecutive:
+        return f"y[{indices[0]}:{indices[-1] + 1}]"
+    indices_array = pybamm.Array(indices)
+    constant_symbols[indices_array.id] = indices
+    index_name = id_to_python_variable(indices_array.id, True)
+    return f"y[{index_name}]"
+
+
+def time_to_python(symbol, children_vars, constant_symbols, output_jax):
+    return "t"
+
+
+def input_parameter_to_python(symbol, children_vars, constant_symbols, output_jax):
+    return f'inputs["{symbol.name}"]'
+
+
+# the function that writes the code for each class of node. Subclasses of these
+# classes use the function of the first class in this list that they are an instance
+# of, e.g. all binary operators that do not need special handling are written as
+# `left <name> right`
+EMITTERS = [
+    (pybamm.Multiplication, multiplication_to_python),
+    (pybamm.Inner, multiplication_to_python),
+    (pybamm.Division, division_to_python),
+    (pybamm.Minimum, minimum_to_python),
+    (pybamm.Maximum, maximum_to_python),
+    (pybamm.MatrixMultiplication, matrix_multiplication_to_python),
+    (pybamm.BinaryOperator, binary_operator_to_python),
+    (pybamm.Index, index_to_python),
+    (pybamm.UnaryOperator, unary_operator_to_python),
+    (pybamm.Function, function_to_python),
+    (pybamm.NumpyConcatenation, numpy_concatenation_to_python),
+    (pybamm.SparseStack, sparse_stack_to_python),
+    (pybamm.DomainConcatenation, domain_concatenation_to_python),
+    (pybamm.Concatenation, concatenation_to_python),
+    (pybamm.StateVector, state_vector_to_python),
+    (pybamm.Time, time_to_python),
+    (pybamm.InputParameter, input_parameter_to_python),
+]
+
+# the function from EMITTERS for each type of node, so that it is found with a single
+# lookup. Filled in for other subclasses as they are found, see `find_emitter`
+EMITTERS_BY_TYPE = dict(EMITTERS)
+
+
+def find_emitter(symbol):
+    """
+    Find the function that writes the code for `symbol` (see `EMITTERS`), and store
+    it in `EMITTERS_BY_TYPE` for any other node of the same type
+    """
+    for node_class, emitter in EMITTERS:
+        if isinstance(symbol, node_class):
+            EMITTERS_BY_TYPE[type(symbol)] = emitter
+            return emitter
+    raise NotImplementedError(
+        "Conversion to python not implemented for a symbol of type "
+        f"'{type(symbol)}'"
+    )
+
+
+# sparse constants at least this dense, and with at most this many entries, are stored
+# as dense arrays if they are only used in matrix-vector products
+DENSE_MATRIX_THRESHOLD = 0.25
+DENSE_MATRIX_MAX_SIZE = 1e6
+
+
+def lower_sparse_constants(symbol, constant_symbols):
+    """
+    Choose the storage format of the sparse matrix constants found by
+    :func:`find_symbols`. Matrices that are only used as the left hand side of
+    matrix-vector products in the generated code, and are dense enough, are converted
+    to dense arrays (a dense matrix-vector product is faster than a sparse one at that
+    density, and the result is a dense array either way). All other sparse matrices
+    used in the generated code are converted to CSR format.
+
+    Parameters
+    ----------
+    symbol : :class:`pybamm.Symbol`
+        The expression tree that was converted with :func:`find_symbols`
+    constant_symbols: dict
+        The dictionary of constant symbol ids to values, modified in place
+    """
+    matvec_ids = set()
+    other_ids = set()
+    visited = set()
+
+    def find_uses(node):
+        if node.id in visited or node.is_constant():
+            return
+        visited.add(node.id)
+        for child in node.children:
+            if child.is_constant() and scipy.sparse.issparse(
+                constant_symbols.get(child.id)
+            ):
+                if (
+                    isinstance(node, pybamm.MatrixMultiplication)
+                    and child is node.left
+                    and not is_sparse(node.right)
+                ):
+                    matvec_ids.add(child.id)
+                else:
+                    other_ids.add(child.id)
+            find_uses(child)
+
+    find_uses(symbol)
+
+    for symbol_id in matvec_ids | other_ids:
+        value = constant_symbols[symbol_id]
+        size = np.prod(value.shape)
+        if (
+            symbol_id not in other_ids
+            and size <= DENSE_MATRIX_MAX_SIZE
+            and value.nnz > DENSE_MATRIX_THRESHOLD * size
+        ):
+            constant_symbols[symbol_id] = value.toarray()
         else:
-            indices_array = pybamm.Array(indices)
-            constant_symbols[indices_array.id] = indices
-            index_name = id_to_python_variable(indices_array.id, True)
-            symbol_str = "y[{}]".format(index_name)
+            constant_symbols[symbol_id] = value.tocsr()
 
-    elif isinstance(symbol, pybamm.Time):
-        symbol_str = "t"
 
-    elif isinstance(symbol, pybamm.InputParameter):
-        symbol_str = 'inputs["{}"]'.format(symbol.name)
+# regex for the python variable names of variable nodes, see id_to_python_variable
+VARIABLE_NAME_REGEX = re.compile(r"\bvar_\w+")
+# regex for a line of code that is just the name of another variable or constant
+ALIAS_LINE_REGEX = re.compile(r"(?:var|const)_\w+")
+# regex for a simple line of code (a name or number, optionally indexed), which can be
+# substituted into another line without changing its meaning
+SIMPLE_LINE_REGEX = re.compile(r"[\w.]+(\[[^\[\]]*\])*")
 
-    else:
-        raise NotImplementedError(
-            "Conversion to python not implemented for a symbol of type '{}'".format(
-                type(symbol)
-            )
-        )
 
-    variable_symbols[symbol.id] = symbol_str
+def inline_variables(variable_symbols, result_id):
+    """
+    Copy propagation for the lines of code found by :func:`find_symbols`: any
+    variable whose line of code is just the name of another variable (e.g.
+    single-child concatenations) is renamed to that variable wherever it is used, and
+    any other variable that is only used once, and whose line of code is a simple name
+    or indexing expression (e.g. state vectors and indexes), is substituted into the
+    line that uses it. In both cases, the assignment to the variable is removed.
+
+    Parameters
+    ----------
+    variable_symbols : dict
+        The dictionary of variable symbol ids to lines of code, modified in place
+    result_id : int
+        The id of the variable holding the final result, which is never removed
+    """
+    # count the number of times each variable is used
+    counts = {}
+    for symbol_line in variable_symbols.values():
+        for var in VARIABLE_NAME_REGEX.findall(symbol_line):
+            counts[var] = counts.get(var, 0) + 1
+
+    # lines are ordered so that variables are always defined before they are used,
+    # so a single pass substitutes chains of simple lines
+    aliases = {}
+    substitutions = {}
+
+    def substitute(match):
+        var = match.group(0)
+        if var in aliases:
+            return aliases[var]
+        return substitutions.pop(var, var)
+
+    for symbol_id, symbol_line in list(variable_symbols.items()):
+        if aliases or substitutions:
+            symbol_line = VARIABLE_NAME_REGEX.sub(substitute, symbol_line)
+            variable_symbols[symbol_id] = symbol_line
+        if symbol_id == result_id:
+            continue
+        var = id_to_python_variable(symbol_id, False)
+        if ALIAS_LINE_REGEX.fullmatch(symbol_line):
+            aliases[var] = symbol_line
+            del variable_symbols[symbol_id]
+        elif counts.get(var) == 1 and SIMPLE_LINE_REGEX.fullmatch(symbol_line):
+            substitutions[var] = symbol_line
+            del variable_symbols[symbol_id]
 
 
 def to_python(symbol, debug=False, output_jax=False):
@@ -396,7 +560,7 @@ def to_python(symbol, debug=False, output_jax=False):
 
     Returns
     -------
-    collections.OrderedDict:
+    dict:
         dict mapping node id to a constant value. Represents all the constant nodes in
         the expression tree
     str:
@@ -407,9 +571,15 @@ def to_python(symbol, debug=False, output_jax=False):
         operations are used
 
     """
-    constant_values = OrderedDict()
-    variable_symbols = OrderedDict()
+    constant_values = {}
+    variable_symbols = {}
     find_symbols(symbol, constant_values, variable_symbols, output_jax)
+    if not output_jax:
+        lower_sparse_constants(symbol, constant_values)
+
+    # keep every variable when debugging, so that they can all be printed
+    if not debug:
+        inline_variables(variable_symbols, symbol.id)
 
     line_format = "{} = {}"
 
@@ -433,6 +603,118 @@ def to_python(symbol, debug=False, output_jax=False):
     return constant_values, "\n".join(variable_lines)
 
 
+def only_dense_operations(constants, python_str):
+    """
+    Returns True if the python code generated by :func:`to_python` only uses dense
+    numpy arrays and operations, i.e. no scipy sparse matrices, calls to arbitrary
+    python functions or input parameters. Such code can be compiled by Numba or Cython.
+
+    Parameters
+    ----------
+    constants : iterable
+        The constant values passed to the generated code
+    python_str : str
+        The generated python code
+    """
+    dense_constants = all(isinstance(c, np.ndarray) for c in constants)
+    python_only = any(s in python_str for s in ("scipy.", "inputs["))
+    return dense_constants and not python_only
+
+
+# attributes of a node that are not part of its stable hash: the id (which changes
+# between python sessions), the children (which are hashed separately) and the meshes
+# (the slices found from them are hashed instead)
+UNHASHED_ATTRIBUTES = {"_id", "_children", "_orphans", "child", "left", "right"}
+
+
+def is_importable(function):
+    """
+    Returns True if `function` can be found from its module and name (so that it is
+    the same function in every python session, unlike e.g. a lambda function)
+    """
+    module = sys.modules.get(getattr(function, "__module__", None))
+    return getattr(module, getattr(function, "__qualname__", ""), None) is function
+
+
+def stable_bytes(value):
+    """
+    Returns bytes representing `value` that are identical in every python session, or
+    None if there is no such representation (e.g. for a lambda function)
+    """
+    if value is None or isinstance(value, (str, bytes, numbers.Number, slice)):
+        return repr(value).encode()
+    elif isinstance(value, np.ndarray):
+        if value.dtype == object:
+            return None
+        return repr((value.dtype.str, value.shape)).encode() + value.tobytes()
+    elif scipy.sparse.issparse(value):
+        value = value.tocsr()
+        items = [repr(value.shape).encode()] + [
+            stable_bytes(array) for array in (value.data, value.indices, value.indptr)
+        ]
+    elif isinstance(value, (list, tuple)):
+        # long lists are usually all numbers or booleans (e.g. evaluation arrays)
+        if len(value) > 1 and isinstance(value[0], numbers.Number):
+            array = np.asarray(value)
+            if array.dtype.kind in "bif":
+                return stable_bytes(array)
+        items = [stable_bytes(item) for item in value]
+    elif isinstance(value, dict):
+        items = [stable_bytes(item) for item in sorted(value.items(), key=repr)]
+    elif isinstance(value, np.ufunc):
+        return "ufunc {}".format(value.__name__).encode()
+    elif callable(value) and is_importable(value):
+        return "{}.{}".format(value.__module__, value.__qualname__).encode()
+    else:
+        return None
+    if any(item is None for item in items):
+        return None
+    return b"(" + b",".join(items) + b")"
+
+
+def stable_hash(symbol):
+    """
+    Returns a hash of an expression tree that, unlike the ids of its nodes, is the same
+    in every python session, found from the class and attributes of each node. Returns
+    None if any node has an attribute that cannot be hashed in this way.
+
+    Parameters
+    ----------
+    symbol : :class:`pybamm.Symbol`
+        The expression tree to hash
+    """
+    node_hashes = {}
+
+    def node_hash(node):
+        try:
+            return node_hashes[node.id]
+        except KeyError:
+            pass
+        h = hashlib.blake2b(digest_size=20)
+        node_class = type(node)
+        h.update((node_class.__module__ + "." + node_class.__qualname__).encode())
+        for key, value in sorted(vars(node).items()):
+            if (
+                key in UNHASHED_ATTRIBUTES
+                or key.startswith("_saved")
+                or isinstance(value, (pybamm.Mesh, pybamm.SubMesh))
+            ):
+                continue
+            value_bytes = stable_bytes(value)
+            if value_bytes is None:
+                raise TypeError("cannot hash attribute '{}'".format(key))
+            h.update(key.encode() + b"=" + value_bytes)
+        for child in node.children:
+            h.update(node_hash(child))
+        node_hashes[node.id] = h.digest()
+        return node_hashes[node.id]
+
+    try:
+        return node_hash(symbol).hex()
+    except TypeError:
+        return None
+
+
 class EvaluatorPython:
     """
     Converts a pybamm expression tree into pure python code that will calculate the
@@ -447,26 +729,83 @@ class EvaluatorPython:
 
     """
 
+    # whether evaluators can be loaded from the cache in
+    # `pybamm.settings.evaluator_cache_dir`
+    _use_cache = True
+
     def __init__(self, symbol):
+        self._symbol = symbol
+
+        cache_file = self._cache_file(symbol)
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, "rb") as f:
+                state = pickle.load(f)
+            self._constants, self._python_str, self._result_var, code = state
+            self._compiled_code = marshal.loads(code)
+        else:
+            self._generate_code(symbol)
+            self._compiled_code = compile(self._python_str, self._result_var, "exec")
+            if cache_file is not None:
+                self._save_to_cache(cache_file)
+
+        self._evaluate = self._compile_evaluate()
+
+    def _cache_file(self, symbol):
+        """
+        Returns the file in which the evaluator for `symbol` is cached, or None if
+        there is no cache (see `pybamm.settings.evaluator_cache_dir`) or the
+        expression tree has no stable hash (see :func:`stable_hash`)
+        """
+        cache_dir = pybamm.settings.evaluator_cache_dir
+        if cache_dir is None or not self._use_cache:
+            return None
+        symbol_hash = stable_hash(symbol)
+        if symbol_hash is None:
+            return None
+        # compiled code can only be loaded by the same version of python
+        key = hashlib.blake2b(
+            symbol_hash.encode()
+            + importlib.util.MAGIC_NUMBER
+            + pybamm.__version__.encode(),
+            digest_size=20,
+        ).hexdigest()
+        return os.path.join(os.path.expanduser(cache_dir), key + ".pkl")
+
+    def _save_to_cache(self, cache_file):
+        """Save the generated code and constants to `cache_file`"""
+        os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+        state = (
+            self._constants,
+            self._python_str,
+            self._result_var,
+            marshal.dumps(self._compiled_code),
+        )
+        # write to a temporary file first, so that other processes never read a
+        # partially written file
+        fd, temp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file))
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(state, f)
+        os.replace(temp_file, cache_file)
+
+    def _generate_code(self, symbol):
+        """Generate the python code for the function that evaluates `symbol`"""
         constants, python_str = pybamm.to_python(symbol, debug=False)
 
-        # extract constants in generated function
-        for i, symbol_id in enumerate(constants.keys()):
-            const_name = id_to_python_variable(symbol_id, True)
-            python_str = "{} = constants[{}]\n".format(const_name, i) + python_str
+        lines = ["def evaluate(constants, t=None, y=None, inputs=None):"]
 
-        # constants passed in as an ordered dict, convert to list
-        self._constants = list(constants.values())
+        # extract all constants in generated function with a single unpacking, so
+        # that they are local (fast) variables for the rest of the function body
+        if constants:
+            const_names = ", ".join(
+                id_to_python_variable(symbol_id, True) for symbol_id in constants.keys()
+            )
+            lines.append(f"{const_names}, = constants")
 
-        # indent code
-        python_str = "   " + python_str
-        python_str = python_str.replace("\n", "\n   ")
+        # constants passed in as an ordered dict, convert to tuple
+        self._constants = tuple(constants.values())
 
-        # add function def to first line
-        python_str = (
-            "def evaluate(constants, t=None, y=None, "
-            "inputs=None):\n" + python_str
-        )
+        if python_str:
+            lines.extend(python_str.split("\n"))
 
         # calculate the final variable that will output the result of calling `evaluate`
         # on `symbol`
@@ -476,20 +815,27 @@ class EvaluatorPython:
 
         # add return line
         if symbol.is_constant() and isinstance(result_value, numbers.Number):
-            python_str = python_str + "\n   return " + str(result_value)
+            lines.append(f"return {result_value}")
         else:
-            python_str = python_str + "\n   return " + result_var
+            lines.append(f"return {result_var}")
 
-        # store a copy of examine_jaxpr
-        python_str = python_str + "\nself._evaluate = evaluate"
+        # join the lines once, indenting the function body
+        python_str = "\n   ".join(lines)
 
         self._python_str = python_str
         self._result_var = result_var
-        self._symbol = symbol
 
-        # compile and run the generated python code,
-        compiled_function = compile(python_str, result_var, "exec")
-        exec(compiled_function)
+    def _compile_evaluate(self):
+        """
+        Return the function defined by the compiled python code.
+
+        The code is executed in its own namespace (rather than the locals of the
+        caller), so that the generated function is a plain python function that can be
+        called directly, with all intermediate variables stored as fast locals.
+        """
+        namespace = {"np": np, "scipy": scipy}
+        exec(self._compiled_code, namespace)
+        return namespace["evaluate"]
 
     def __call__(self, t=None, y=None, inputs=None):
         """
@@ -499,9 +845,15 @@ class EvaluatorPython:
         if y is not None and y.ndim == 1:
             y = y.reshape(-1, 1)
 
-        result = self._evaluate(self._constants, t, y, inputs)
+        return self.evaluate_col(t, y, inputs)
 
-        return result
+    def evaluate_col(self, t=None, y=None, inputs=None):
+        """
+        evaluate function, for a `y` that is already a column vector (a 2D array of
+        shape (n, 1)). Callers that always pass in the same kind of `y` (e.g. the
+        solvers) can call this directly, skipping the checks in `__call__`
+        """
+        return self._evaluate(self._constants, t, y, inputs)
 
     def __getstate__(self):
         # Control the state of instances of EvaluatorPython
@@ -509,16 +861,479 @@ class EvaluatorPython:
         # See https://github.com/pybamm-team/PyBaMM/issues/1283
         state = self.__dict__.copy()
         del state["_evaluate"]
+        del state["_compiled_code"]
         return state
 
     def __setstate__(self, state):
         # Restore pickled attributes and
         # compile code from "python_str"
-        # Execution of bytecode (re)adds attribute
-        # "_method"
         self.__dict__.update(state)
-        compiled_function = compile(self._python_str, self._result_var, "exec")
-        exec(compiled_function)
+        self._compiled_code = compile(self._python_str, self._result_var, "exec")
+        self._evaluate = self._compile_evaluate()
+
+
+class EvaluatorNumba(EvaluatorPython):
+    """
+    Converts a pybamm expression tree into pure python code that will calculate the
+    result of calling `evaluate(t, y)` on the given expression tree. The resultant code
+    is compiled with Numba
+
+    Limitations: Numba's `nopython` mode does not support scipy sparse matrices,
+    calls to arbitrary python functions or dictionaries of inputs, so any expression
+    tree that contains these is evaluated with the pure python code instead (see
+    :class:`pybamm.EvaluatorPython`)
+
+    Parameters
+    ----------
+
+    symbol : :class:`pybamm.Symbol`
+        The symbol to convert to python code
+
+
+    """
+
+    def __init__(self, symbol):
+        if not pybamm.have_numba():
+            raise ModuleNotFoundError(
+                "Numba is not installed, please install it with `pip install numba`"
+            )
+
+        super().__init__(symbol)
+
+    @property
+    def jittable(self):
+        """
+        True if the generated code only uses dense numpy operations, and can therefore
+        be compiled by Numba
+        """
+        return only_dense_operations(self._constants, self._python_str)
+
+    def _compile_evaluate(self):
+        """See :meth:`EvaluatorPython._compile_evaluate()`"""
+        evaluate = super()._compile_evaluate()
+        self._jittable = self.jittable
+        if self._jittable:
+            evaluate = numba.njit(fastmath=True, boundscheck=False)(evaluate)
+        return evaluate
+
+    def evaluate_col(self, t=None, y=None, inputs=None):
+        """See :meth:`EvaluatorPython.evaluate_col()`"""
+        if self._jittable:
+            # jittable code never uses the inputs, which the solvers pass in as a
+            # dict (often empty) that Numba cannot type
+            inputs = None
+        try:
+            return super().evaluate_col(t, y, inputs)
+        except (numba.core.errors.NumbaError, NotImplementedError):
+            # Numba could not compile the generated code for these arguments, use
+            # the pure python version instead from now on
+            pybamm.logger.debug(
+                "Could not compile '{}' with Numba, falling back to python".format(
+                    self._result_var
+                )
+            )
+            self._evaluate = super()._compile_evaluate()
+            return super().evaluate_col(t, y, inputs)
+
+
+class EvaluatorCython(EvaluatorPython):
+    """
+    Converts a pybamm expression tree into Cython code that will calculate the
+    result of calling `evaluate(t, y)` on the given expression tree. The generated
+    code is compiled into an extension module, which is stored in `build_dir` and
+    reused by any later evaluator with identical code
+
+    Limitations: as for :class:`pybamm.EvaluatorNumba`, only expression trees using
+    dense numpy operations are compiled, any other expression tree is evaluated with
+    the pure python code instead (see :class:`pybamm.EvaluatorPython`)
+
+    Parameters
+    ----------
+
+    symbol : :class:`pybamm.Symbol`
+        The symbol to convert to Cython code
+    build_dir : str, optional
+        The directory in which the generated code is compiled. Default is
+        "~/.cache/pybamm/cython". Extension modules found in this directory are
+        imported, so it must only be writable by trusted users
+
+
+    """
+
+    # the names of the array variables declared in the Cython code are found from the
+    # node ids, which change between python sessions
+    _use_cache = False
+
+    def __init__(self, symbol, build_dir=None):
+        if not pybamm.have_cython():
+            raise ModuleNotFoundError(
+                "Cython is not installed, please install it with `pip install cython`"
+            )
+
+        # use a directory owned by the user rather than the shared temporary
+        # directory, as any extension module found there is imported
+        self._build_dir = build_dir or os.path.join(
+            os.path.expanduser("~"), ".cache", "pybamm", "cython"
+        )
+
+        # all variable nodes that evaluate to an array are declared as numpy arrays
+        # in the generated code
+        self._array_vars = {
+            id_to_python_variable(node.id, False)
+            for node in symbol.pre_order()
+            if not node.is_constant()
+            and isinstance(node.evaluate_for_shape(), np.ndarray)
+        }
+
+        super().__init__(symbol)
+
+    @property
+    def compilable(self):
+        """
+        True if the generated code only uses dense numpy operations, and can therefore
+        be compiled by Cython
+        """
+        return only_dense_operations(self._constants, self._python_str)
+
+    def _cython_str(self):
+        """Return the Cython code for the generated function"""
+        body = self._python_str.split("\n", 1)[1]
+
+        # node ids (and hence variable names) change between python sessions, so
+        # rename the variables in order of appearance to get the same code (and
+        # module) for the same expression tree
+        names = {}
+        for name in re.findall(r"\b(?:var|const)_\w+", body):
+            names.setdefault(name, "{}_{}".format(name.split("_")[0], len(names)))
+        body = re.sub(r"\b(?:var|const)_\w+", lambda m: names[m.group(0)], body)
+
+        declarations = "".join(
+            "   cdef np.ndarray {}\n".format(names[var])
+            for var in names
+            if var in self._array_vars
+        )
+        return (
+            "# cython: language_level=3\n"
+            "cimport cython\n"
+            "import numpy as np\n"
+            "cimport numpy as np\n"
+            "\n"
+            "@cython.boundscheck(False)\n"
+            "@cython.wraparound(False)\n"
+            "@cython.cdivision(True)\n"
+            "def evaluate(tuple constants, t=None, np.ndarray y=None, inputs=None):\n"
+            + declarations
+            + body
+            + "\n"
+        )
+
+    def _compile_evaluate(self):
+        """See :meth:`EvaluatorPython._compile_evaluate()`"""
+        if not self.compilable:
+            return super()._compile_evaluate()
+
+        try:
+            return self._build_module(self._cython_str()).evaluate
+        except Exception as error:
+            # e.g. no C compiler is available, use the pure python version instead
+            pybamm.logger.debug(
+                f"Could not compile '{self._result_var}' with Cython ({error}), "
+                "falling back to python"
+            )
+            return super()._compile_evaluate()
+
+    def _build_module(self, cython_str):
+        """
+        Build (if it does not already exist) and import the extension module for the
+        Cython code `cython_str`
+        """
+        from Cython.Build import cythonize
+        from setuptools import Distribution, Extension
+
+        module_name = "pybamm_evaluate_" + hashlib.sha1(cython_str.encode()).hexdigest()
+        os.makedirs(self._build_dir, mode=0o700, exist_ok=True)
+
+        # only build the extension module if it does not already exist
+        build_ext = Distribution().get_command_obj("build_ext")
+        build_ext.build_lib = self._build_dir
+        so_path = build_ext.get_ext_fullpath(module_name)
+        if os.path.exists(so_path) and hasattr(os, "getuid"):
+            if os.stat(so_path).st_uid != os.getuid():
+                raise PermissionError(
+                    f"'{so_path}' is not owned by the current user, so is not imported"
+                )
+        if not os.path.exists(so_path):
+            pyx_path = os.path.join(self._build_dir, module_name + ".pyx")
+            with open(pyx_path, "w") as f:
+                f.write(cython_str)
+            extension = Extension(
+                module_name,
+                [pyx_path],
+                include_dirs=[np.get_include()],
+                define_macros=[("NPY_NO_DEPRECATED_API", "NPY_1_7_API_VERSION")],
+            )
+            build_ext = Distribution(
+                {"ext_modules": cythonize([extension], quiet=True)}
+            ).get_command_obj("build_ext")
+            build_ext.build_lib = self._build_dir
+            build_ext.build_temp = os.path.join(self._build_dir, "build")
+            build_ext.ensure_finalized()
+            build_ext.run()
+
+        spec = importlib.util.spec_from_file_location(module_name, so_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+
+# elementwise binary operators, and the numpy functions that have a symengine
+# equivalent, as used by `to_symengine`
+SYMENGINE_OPERATORS = {
+    pybamm.Addition: operator.add,
+    pybamm.Subtraction: operator.sub,
+    pybamm.Multiplication: operator.mul,
+    pybamm.Inner: operator.mul,
+    pybamm.Division: operator.truediv,
+    pybamm.Power: operator.pow,
+}
+SYMENGINE_FUNCTIONS = {
+    np.arcsinh: "asinh",
+    np.arctan: "atan",
+    np.cos: "cos",
+    np.cosh: "cosh",
+    np.exp: "exp",
+    np.log: "log",
+    np.sin: "sin",
+    np.sinh: "sinh",
+    np.sqrt: "sqrt",
+    np.tanh: "tanh",
+    special.erf: "erf",
+}
+
+
+def elementwise(function, *values):
+    """Apply the scalar function `function` to each entry of (object) arrays"""
+    return np.frompyfunc(function, len(values), 1)(*values)
+
+
+def to_symengine_dense(value):
+    """Convert a sparse matrix of floats to a dense (object) array"""
+    if scipy.sparse.issparse(value):
+        return value.toarray().astype(object)
+    return value
+
+
+def to_symengine(symbol, t, y):
+    """
+    Convert a pybamm expression tree to symengine expressions, in terms of the
+    symengine symbol `t` and the (object) array of symengine symbols `y`.
+
+    Returns a python float, a scipy sparse matrix (for constants only) or an (object)
+    array of symengine expressions with the same shape as
+    `symbol.evaluate_for_shape()`. Raises NotImplementedError for any node that
+    cannot be written in symengine
+    """
+    values = {}
+
+    def value(node):
+        if node.id in values:
+            return values[node.id]
+
+        if node.is_constant():
+            result = node.evaluate()
+            if isinstance(result, numbers.Number):
+                result = float(result)
+            elif isinstance(result, np.ndarray):
+                result = result.astype(object)
+            elif not scipy.sparse.issparse(result):
+                raise NotImplementedError(
+                    f"Cannot write a constant of type '{type(result)}' in symengine"
+                )
+        elif isinstance(node, pybamm.StateVector):
+            result = y[: len(node.evaluation_array)][node.evaluation_array]
+            result = result.reshape(-1, 1)
+        elif isinstance(node, pybamm.Time):
+            result = t
+        elif type(node) in SYMENGINE_OPERATORS:
+            left, right = (to_symengine_dense(value(child)) for child in node.children)
+            result = SYMENGINE_OPERATORS[type(node)](left, right)
+        elif isinstance(node, pybamm.MatrixMultiplication):
+            left, right = (value(child) for child in node.children)
+            if scipy.sparse.issparse(right):
+                raise NotImplementedError(
+                    "Cannot write a product with a sparse right operand in symengine"
+                )
+            if scipy.sparse.issparse(left):
+                # only use the non-zero entries of the sparse matrix
+                left = left.tocsr()
+                result = np.empty((left.shape[0], right.shape[1]), dtype=object)
+                for i in range(left.shape[0]):
+                    row = slice(left.indptr[i], left.indptr[i + 1])
+                    result[i] = left.data[row].astype(object) @ right[left.indices[row]]
+            else:
+                result = np.dot(left, right)
+        elif isinstance(node, (pybamm.Minimum, pybamm.Maximum)):
+            function = (
+                symengine.Min if isinstance(node, pybamm.Minimum) else symengine.Max
+            )
+            left, right = (to_symengine_dense(value(child)) for child in node.children)
+            result = elementwise(function, left, right)
+        elif isinstance(node, (pybamm.EqualHeaviside, pybamm.NotEqualHeaviside)):
+            relation = (
+                symengine.Le
+                if isinstance(node, pybamm.EqualHeaviside)
+                else symengine.Lt
+            )
+            left, right = (to_symengine_dense(value(child)) for child in node.children)
+            result = elementwise(
+                lambda a, b: symengine.Piecewise((1, relation(a, b)), (0, True)),
+                left,
+                right,
+            )
+        elif isinstance(node, pybamm.Negate):
+            result = -to_symengine_dense(value(node.child))
+        elif isinstance(node, pybamm.AbsoluteValue):
+            result = elementwise(symengine.Abs, to_symengine_dense(value(node.child)))
+        elif isinstance(node, pybamm.Index):
+            result = to_symengine_dense(value(node.child))[node.slice]
+        elif (
+            isinstance(node, pybamm.Function)
+            and node.function in SYMENGINE_FUNCTIONS
+        ):
+            function = getattr(symengine, SYMENGINE_FUNCTIONS[node.function])
+            result = elementwise(function, to_symengine_dense(value(node.children[0])))
+        elif isinstance(node, pybamm.NumpyConcatenation):
+            result = np.concatenate(
+                [
+                    np.reshape(to_symengine_dense(value(child)), (-1, 1))
+                    for child in node.children
+                ]
+            )
+        elif isinstance(node, pybamm.DomainConcatenation):
+            # as in `DomainConcatenation._concatenation_evaluate`, for object arrays
+            result = np.empty((node.size, 1), dtype=object)
+            for child, slices in zip(node.children, node._children_slices):
+                child_value = to_symengine_dense(value(child))
+                for child_dom, child_slice in slices.items():
+                    for i, _slice in enumerate(child_slice):
+                        result[node._slices[child_dom][i]] = child_value[_slice]
+        else:
+            raise NotImplementedError(
+                f"Conversion to symengine not implemented for a symbol of type "
+                f"'{type(node)}'"
+            )
+
+        values[node.id] = result
+        return result
+
+    return value(symbol)
+
+
+class EvaluatorSymEngine(EvaluatorPython):
+    """
+    Converts a pybamm expression tree into a list of symengine expressions, one for
+    each entry of the result of calling `evaluate(t, y)` on the given expression tree.
+    These are compiled with `symengine.Lambdify` (using the LLVM backend if
+    symengine was built with it), which evaluates all the entries in a single call
+    to compiled code. Unlike :class:`pybamm.EvaluatorNumba`, this also works for
+    products with constant sparse matrices, as only the non-zero entries are used
+
+    Limitations: the expressions are written out entry by entry, so this is only
+    suitable for small to medium sized models. Any expression tree that cannot be
+    written in symengine (e.g. one with input parameters, or a sparse result) is
+    evaluated with the pure python code instead (see :class:`pybamm.EvaluatorPython`)
+
+    Parameters
+    ----------
+
+    symbol : :class:`pybamm.Symbol`
+        The symbol to convert to symengine expressions
+
+
+    """
+
+    def __init__(self, symbol):
+        if not pybamm.have_symengine():
+            raise ModuleNotFoundError(
+                "SymEngine is not installed, please install it with "
+                "`pip install symengine`"
+            )
+
+        n_y = max(
+            (
+                len(node.evaluation_array)
+                for node in symbol.pre_order()
+                if isinstance(node, pybamm.StateVector)
+            ),
+            default=0,
+        )
+        t = symengine.Symbol("t")
+        y = np.array([symengine.Symbol(f"y{i}") for i in range(n_y)], dtype=object)
+        try:
+            result = to_symengine(symbol, t, y)
+            if scipy.sparse.issparse(result) or scipy.sparse.issparse(
+                symbol.evaluate_for_shape()
+            ):
+                raise NotImplementedError(
+                    "Cannot write an expression tree with a sparse result in symengine"
+                )
+            self._symengine_args = [t] + list(y)
+            self._symengine_shape = np.shape(result)
+            self._symengine_outputs = list(np.ravel(result))
+        except (NotImplementedError, RecursionError) as error:
+            pybamm.logger.debug(
+                f"Could not write '{symbol.name}' in symengine ({error}), "
+                "falling back to python"
+            )
+            self._symengine_outputs = None
+
+        super().__init__(symbol)
+
+    @property
+    def lambdifiable(self):
+        """True if the expression tree could be written in symengine"""
+        return self._symengine_outputs is not None
+
+    def _compile_evaluate(self):
+        """See :meth:`EvaluatorPython._compile_evaluate()`"""
+        if not self.lambdifiable:
+            return super()._compile_evaluate()
+
+        backend = "llvm" if symengine.have_llvm else "lambda"
+        lambdified = symengine.Lambdify(
+            self._symengine_args, self._symengine_outputs, backend=backend
+        )
+        n_y = len(self._symengine_args) - 1
+        shape = self._symengine_shape
+        args = np.zeros(n_y + 1)
+
+        def evaluate(constants, t=None, y=None, inputs=None):
+            if n_y and y.shape[1] != 1:
+                # the expressions are written for a single column of y, so evaluate
+                # each column in turn
+                return np.hstack(
+                    [
+                        evaluate(constants, t, y[:, i : i + 1], inputs)
+                        for i in range(y.shape[1])
+                    ]
+                )
+            args[0] = 0 if t is None else t
+            if n_y:
+                args[1:] = y[:n_y, 0]
+            result = lambdified(args)
+            return result.reshape(shape) if shape else result.item()
+
+        return evaluate
+
+
+# evaluators for the "python" format, by the name used in
+# `pybamm.settings.python_evaluator`
+EVALUATORS = {
+    "python": EvaluatorPython,
+    "numba": EvaluatorNumba,
+    "cython": EvaluatorCython,
+    "symengine": EvaluatorSymEngine,
+}
 
 
 class EvaluatorJax:
@@ -594,15 +1409,16 @@ class EvaluatorJax:
         else:
             python_str = python_str + "\n   return " + result_var
 
-        # store a copy of examine_jaxpr
-        python_str = python_str + "\nself._evaluate_jax = evaluate_jax"
-
         # store the final generated code
         self._python_str = python_str
 
-        # compile and run the generated python code,
+        # compile and run the generated python code in its own namespace, as in
+        # EvaluatorPython._compile_evaluate, so that the function definition is the
+        # only statement that is executed
         compiled_function = compile(python_str, result_var, "exec")
-        exec(compiled_function)
+        namespace = {"np": np, "jax": jax}
+        exec(compiled_function, namespace)
+        self._evaluate_jax = namespace["evaluate_jax"]
 
         self._static_argnums = tuple(static_argnums)
         self._jit_evaluate = jax.jit(
@@ -20,7 +20,7 @@ class BaseElectrolyteDiffusion(pybamm.BaseSubModel):
     def __init__(self, param, options=None):
         super().__init__(param, options=options)
 
-    def _get_standard_concentration_variables(self, c_e_n, c_e_s, c_e_p):
+    def _get_standard_concentration_variables(self, c_e_n, c_e_s, c_e_p, c_e=None):
         """
         A private function to obtain the standard variables which
         can be derived from the concentration in the electrolyte.
@@ -33,6 +33,9 @@ class BaseElectrolyteDiffusion(pybamm.BaseSubModel):
             The electrolyte concentration in the separator.
         c_e_p : :class:`pybamm.Symbol`
             The electrolyte concentration in the positive electrode.
+        c_e : :class:`pybamm.Symbol`, optional
+            The electrolyte concentration in the whole cell. Default is the
+            concatenation of `c_e_n`, `c_e_s` and `c_e_p`.
 
         Returns
         -------
@@ -42,7 +45,8 @@ class BaseElectrolyteDiffusion(pybamm.BaseSubModel):
         """
 
         c_e_typ = self.param.c_e_typ
-        c_e = pybamm.concatenation(c_e_n, c_e_s, c_e_p)
+        if c_e is None:
+            c_e = pybamm.concatenation(c_e_n, c_e_s, c_e_p)
 
         if self.half_cell:
             # overwrite c_e_n to be the boundary value of c_e_s
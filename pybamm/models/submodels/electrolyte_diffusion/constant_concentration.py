@@ -25,51 +25,46 @@ class ConstantConcentration(BaseElectrolyteDiffusion):
     def get_fundamental_variables(self):
         if self.half_cell:
             c_e_n = None
+            domains = ["separator", "positive electrode"]
         else:
             c_e_n = pybamm.FullBroadcast(1, "negative electrode", "current collector")
+            domains = ["negative electrode", "separator", "positive electrode"]
         c_e_s = pybamm.FullBroadcast(1, "separator", "current collector")
         c_e_p = pybamm.FullBroadcast(1, "positive electrode", "current collector")
 
-        variables = self._get_standard_concentration_variables(c_e_n, c_e_s, c_e_p)
+        # the concentration is the same constant everywhere, so the concentration in
+        # the whole cell is a single broadcast rather than a concatenation
+        c_e = pybamm.FullBroadcast(1, domains, "current collector")
 
-        if self.half_cell:
-            N_e = pybamm.FullBroadcastToEdges(
-                0, ["separator", "positive electrode"], "current collector"
-            )
-        else:
-            N_e = pybamm.FullBroadcastToEdges(
-                0,
-                ["negative electrode", "separator", "positive electrode"],
-                "current collector",
-            )
+        variables = self._get_standard_concentration_variables(
+            c_e_n, c_e_s, c_e_p, c_e=c_e
+        )
+
+        N_e = pybamm.FullBroadcastToEdges(0, domains, "current collector")
 
         variables.update(self._get_standard_flux_variables(N_e))
 
         return variables
 
     def get_coupled_variables(self, variables):
+        # the concentration is identically one, so porosity times concentration is
+        # just the porosity
         if self.half_cell:
-            eps_c_e_n = None
+            eps_n = None
         else:
             eps_n = variables["Negative electrode porosity"]
-            c_e_n = variables["Negative electrolyte concentration"]
-            eps_c_e_n = eps_n * c_e_n
-
         eps_s = variables["Separator porosity"]
         eps_p = variables["Positive electrode porosity"]
-        c_e_s = variables["Separator electrolyte concentration"]
-        c_e_p = variables["Positive electrolyte concentration"]
 
         variables.update(
             self._get_standard_porosity_times_concentration_variables(
-                eps_c_e_n, eps_s * c_e_s, eps_p * c_e_p
+                eps_n, eps_s, eps_p
             )
         )
 
-        c_e = variables["Electrolyte concentration"]
         eps = variables["Porosity"]
 
-        variables.update(self._get_total_concentration_electrolyte(eps * c_e))
+        variables.update(self._get_total_concentration_electrolyte(eps))
 
         return variables
 
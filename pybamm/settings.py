@@ -1,6 +1,9 @@
 #
 # Settings class for PyBaMM
 #
+import os
+
+import pybamm
 
 
 class Settings(object):
@@ -10,6 +13,8 @@ class Settings(object):
     _max_smoothing = "exact"
     _heaviside_smoothing = "exact"
     _abs_smoothing = "exact"
+    _evaluator_cache_dir = None
+    _python_evaluator = None
     max_words_in_line = 4
 
     @property
@@ -30,6 +35,38 @@ class Settings(object):
         assert isinstance(value, bool)
         self._simplify = value
 
+    @property
+    def evaluator_cache_dir(self):
+        return self._evaluator_cache_dir
+
+    @evaluator_cache_dir.setter
+    def evaluator_cache_dir(self, value):
+        # directory in which python evaluators are cached, e.g. "~/.pybamm_cache"
+        # (None to disable the cache). Cached evaluators are loaded with pickle, so
+        # this must be a directory that only trusted users can write to
+        assert value is None or isinstance(value, str)
+        self._evaluator_cache_dir = value
+
+    @property
+    def python_evaluator(self):
+        # evaluator used by the solvers for models converted to the "python" format,
+        # see `pybamm.EVALUATORS`. The default can be set with the environment
+        # variable PYBAMM_PYTHON_EVALUATOR, which is checked in the same way as any
+        # other value
+        if self._python_evaluator is None:
+            self.python_evaluator = os.environ.get("PYBAMM_PYTHON_EVALUATOR", "python")
+        return self._python_evaluator
+
+    @python_evaluator.setter
+    def python_evaluator(self, value):
+        if value not in pybamm.EVALUATORS:
+            raise ValueError(
+                "python evaluator must be one of {}, not '{}'".format(
+                    ", ".join(f"'{name}'" for name in pybamm.EVALUATORS), value
+                )
+            )
+        self._python_evaluator = value
+
     def set_smoothing_parameters(self, k):
         "Helper function to set all smoothing parameters"
         self.min_smoothing = k
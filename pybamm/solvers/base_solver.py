@@ -365,6 +365,7 @@ class BaseSolver(object):
             elif model.convert_to_format != "casadi":
                 # Process with pybamm functions, converting
                 # to python evaluator
+                Evaluator = pybamm.EVALUATORS[pybamm.settings.python_evaluator]
                 if model.calculate_sensitivities:
                     report(
                         (
@@ -379,7 +380,7 @@ class BaseSolver(object):
 
                     report(f"Converting sensitivities for {name} to python")
                     jacp_dict = {
-                        p: pybamm.EvaluatorPython(jacp)
+                        p: Evaluator(jacp)
                         for p, jacp in jacp_dict.items()
                     }
 
@@ -396,7 +397,7 @@ class BaseSolver(object):
                     report(f"Calculating jacobian for {name}")
                     jac = jacobian.jac(symbol, y)
                     report(f"Converting jacobian for {name} to python")
-                    jac = pybamm.EvaluatorPython(jac)
+                    jac = Evaluator(jac)
                     # cannot do jacobian action efficiently for now
                     jac_action = None
                 else:
@@ -404,7 +405,7 @@ class BaseSolver(object):
                     jac_action = None
 
                 report(f"Converting {name} to python")
-                func = pybamm.EvaluatorPython(symbol)
+                func = Evaluator(symbol)
 
             else:
                 # Process with CasADi
@@ -110,6 +110,14 @@ class ScikitsDaeSolver(pybamm.BaseSolver):
                     rhs_algebraic_eval(t, y, inputs).full().flatten()
                     - mass_matrix @ ydot
                 )
+        elif model.convert_to_format == "python":
+            rhs_algebraic_eval_col = rhs_algebraic_eval.evaluate_col
+
+            def eqsres(t, y, ydot, return_residuals):
+                return_residuals[:] = (
+                    rhs_algebraic_eval_col(t, y.reshape(-1, 1), inputs).flatten()
+                    - mass_matrix @ ydot
+                )
         else:
             def eqsres(t, y, ydot, return_residuals):
                 return_residuals[:] = (
@@ -95,6 +95,11 @@ class ScikitsOdeSolver(pybamm.BaseSolver):
         if model.convert_to_format == "casadi":
             def eqsydot(t, y, return_ydot):
                 return_ydot[:] = derivs(t, y, inputs).full().flatten()
+        elif model.convert_to_format == "python":
+            derivs_col = derivs.evaluate_col
+
+            def eqsydot(t, y, return_ydot):
+                return_ydot[:] = derivs_col(t, y.reshape(-1, 1), inputs).flatten()
         else:
             def eqsydot(t, y, return_ydot):
                 return_ydot[:] = derivs(t, y, inputs).flatten()
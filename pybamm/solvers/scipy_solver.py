@@ -95,6 +95,11 @@ class ScipySolver(pybamm.BaseSolver):
         if model.convert_to_format == 'casadi':
             def rhs(t, y):
                 return model.rhs_eval(t, y, inputs).full().reshape(-1)
+        elif model.convert_to_format == 'python':
+            rhs_eval_col = model.rhs_eval.evaluate_col
+
+            def rhs(t, y):
+                return rhs_eval_col(t, y.reshape(-1, 1), inputs).reshape(-1)
         else:
             def rhs(t, y):
                 return model.rhs_eval(t, y, inputs).reshape(-1)
@@ -383,6 +383,21 @@ def is_jax_compatible():
     )
 
 
+def have_numba():
+    """Check if numba is installed"""
+    return importlib.util.find_spec("numba") is not None
+
+
+def have_cython():
+    """Check if Cython is installed"""
+    return importlib.util.find_spec("Cython") is not None
+
+
+def have_symengine():
+    """Check if SymEngine is installed"""
+    return importlib.util.find_spec("symengine") is not None
+
+
 def install_jax(arguments=None):  # pragma: no cover
     """
     Install compatible versions of jax, jaxlib.
@@ -7,10 +7,22 @@ from tests import get_discretisation_for_testing, get_1p1d_discretisation_for_te
 import unittest
 import numpy as np
 import scipy.sparse
+import pickle
+import os
+import tempfile
+import types
 from collections import OrderedDict
+from pybamm.expression_tree.operations.evaluate_python import (
+    EMITTERS_BY_TYPE,
+    binary_operator_to_python,
+    is_sparse,
+    stable_hash,
+)
 
 if pybamm.have_jax():
     import jax
+if pybamm.have_numba():
+    import numba
 
 
 def test_function(arg):
@@ -173,6 +185,91 @@ class TestEvaluate(unittest.TestCase):
             with self.assertRaises(NotImplementedError):
                 pybamm.find_symbols(expr, constant_symbols, variable_symbols)
 
+    def test_find_emitter(self):
+        class NewAddition(pybamm.Addition):
+            pass
+
+        # subclasses are written in the same way as their parent class
+        a = pybamm.StateVector(slice(0, 1))
+        b = pybamm.StateVector(slice(1, 2))
+        expr = NewAddition(a, b)
+        self.assertNotIn(NewAddition, EMITTERS_BY_TYPE)
+        constant_symbols, variable_str = pybamm.to_python(expr)
+        self.assertIs(EMITTERS_BY_TYPE[NewAddition], binary_operator_to_python)
+        evaluator = pybamm.EvaluatorPython(expr)
+        y = np.array([[2.0], [3.0]])
+        np.testing.assert_allclose(evaluator(y=y), expr.evaluate(y=y))
+
+    def test_id_to_python_variable(self):
+        self.assertEqual(pybamm.id_to_python_variable(255), "var_00000000000000ff")
+        self.assertEqual(
+            pybamm.id_to_python_variable(-1, True), "const_ffffffffffffffff"
+        )
+        self.assertNotEqual(
+            pybamm.id_to_python_variable(-(2**63)),
+            pybamm.id_to_python_variable(2**63 - 1),
+        )
+
+    def test_is_sparse(self):
+        a = pybamm.StateVector(slice(0, 2))
+        A = pybamm.Matrix(scipy.sparse.csr_matrix(np.array([[1, 0], [0, 4]])))
+        B = pybamm.Matrix(np.array([[1, 0], [0, 4]]))
+        for expr, sparse in [
+            (a, False),
+            (pybamm.t, False),
+            (A, True),
+            (B, False),
+            (A * a, True),
+            (A @ a, False),
+            (B * a, False),
+        ]:
+            self.assertEqual(is_sparse(expr), sparse)
+
+        # only the line for the (static) sparsity of the children is written
+        constant_symbols = OrderedDict()
+        variable_symbols = OrderedDict()
+        for expr, line in [
+            (pybamm.t * A, "{1}.multiply({0})"),
+            (A * pybamm.t, "{0}.multiply({1})"),
+            (A / pybamm.t, "{0}.multiply(1/{1})"),
+            (B * pybamm.t, "{0} * {1}"),
+        ]:
+            pybamm.find_symbols(expr, constant_symbols, variable_symbols)
+            left, right = [
+                pybamm.id_to_python_variable(child.id, child.is_constant())
+                for child in expr.children
+            ]
+            self.assertEqual(variable_symbols[expr.id], line.format(left, right))
+
+    def test_constant_subtrees(self):
+        n_calls = []
+
+        def counted_function(x):
+            n_calls.append(1)
+            return 2 * x
+
+        # constant subtrees are only evaluated once, including when they are used
+        # more than once
+        v = pybamm.StateVector(slice(0, 2))
+        c = pybamm.Function(counted_function, pybamm.Vector([1, 2]))
+        expr = c * v + c
+        n_calls.clear()
+        evaluator = pybamm.EvaluatorPython(expr)
+        self.assertEqual(len(n_calls), 1)
+        y = np.array([[1.0], [2.0]])
+        np.testing.assert_allclose(evaluator(y=y), expr.evaluate(y=y))
+
+        # different functions with the same name give nodes with the same id, so
+        # values are not shared between evaluators
+        def make_function(k):
+            return lambda x: k * x
+
+        w = pybamm.Vector([1, 2])
+        for k in [2, 3]:
+            expr = pybamm.Function(make_function(k), w) * v
+            evaluator = pybamm.EvaluatorPython(expr)
+            np.testing.assert_allclose(evaluator(y=y), [[k], [4 * k]])
+
     def test_domain_concatenation(self):
         disc = get_discretisation_for_testing()
         mesh = disc.mesh
@@ -288,13 +385,40 @@ class TestEvaluate(unittest.TestCase):
 
         # test a * b
         expr = a + b
+        constant_str, variable_str = pybamm.to_python(expr, debug=True)
+        expected_str = (
+            "var_[0-9a-f]+ = y\[0:1\].*\\n.*"
+            "var_[0-9a-f]+ = y\[1:2\].*\\n.*"
+            "var_[0-9a-f]+ = var_[0-9a-f]+ \+ var_[0-9a-f]+"
+        )
+
+        self.assertRegex(variable_str, expected_str)
+
+        # test that simple variables used only once are inlined
+        constant_str, variable_str = pybamm.to_python(expr)
+        expected_str = "^var_[0-9a-f]+ = y\[0:1\] \+ y\[1:2\]$"
+        self.assertRegex(variable_str, expected_str)
+
+        # test that variables used more than once are not inlined
+        expr = (a + b) * (a + b) + b
         constant_str, variable_str = pybamm.to_python(expr)
         expected_str = (
-            "var_[0-9m]+ = y\[0:1\].*\\n"
-            "var_[0-9m]+ = y\[1:2\].*\\n"
-            "var_[0-9m]+ = var_[0-9m]+ \+ var_[0-9m]+"
+            "^var_[0-9a-f]+ = y\[1:2\]\\n"
+            "var_[0-9a-f]+ = y\[0:1\] \+ var_[0-9a-f]+\\n"
+            "var_[0-9a-f]+ = var_[0-9a-f]+ \* var_[0-9a-f]+\\n"
+            "var_[0-9a-f]+ = var_[0-9a-f]+ \+ var_[0-9a-f]+$"
         )
+        self.assertRegex(variable_str, expected_str)
 
+        # test that single-child concatenations are replaced by their child, even if
+        # they are used more than once
+        c = pybamm.NumpyConcatenation(a * b)
+        expr = c * c
+        constant_str, variable_str = pybamm.to_python(expr)
+        expected_str = (
+            "^var_([0-9a-f]+) = y\[0:1\] \* y\[1:2\]\n"
+            "var_[0-9a-f]+ = var_\\1 \* var_\\1$"
+        )
         self.assertRegex(variable_str, expected_str)
 
     def test_evaluator_python(self):
@@ -459,6 +583,38 @@ class TestEvaluate(unittest.TestCase):
             result = evaluator(t=t, y=y)
             np.testing.assert_allclose(result, expr.evaluate(t=t, y=y))
 
+            # test evaluating with y that is already a column vector
+            result = evaluator.evaluate_col(t, y, None)
+            np.testing.assert_allclose(result, expr.evaluate(t=t, y=y))
+
+    def test_lower_sparse_constants(self):
+        a = pybamm.StateVector(slice(0, 2))
+        y = np.array([[2.0], [3.0]])
+        A = pybamm.Matrix(scipy.sparse.coo_matrix(np.array([[1, 0], [0, 4]])))
+        B = pybamm.Matrix(scipy.sparse.coo_matrix(np.array([[0, 0], [0, 4]])))
+
+        # dense enough matrices only used in matrix-vector products become dense,
+        # all other sparse matrices become csr
+        for expr, dense in [
+            (A @ a, True),
+            (B @ a, False),
+            ((A * pybamm.t) @ a, False),
+        ]:
+            constant_symbols, _ = pybamm.to_python(expr)
+            value = constant_symbols[A.id if A.id in constant_symbols else B.id]
+            if dense:
+                self.assertIsInstance(value, np.ndarray)
+            else:
+                self.assertTrue(scipy.sparse.isspmatrix_csr(value))
+            evaluator = pybamm.EvaluatorPython(expr)
+            result = evaluator(t=2.0, y=y)
+            expected = expr.evaluate(t=2.0, y=y)
+            self.assertEqual(type(result), type(expected))
+            np.testing.assert_allclose(
+                result.toarray() if scipy.sparse.issparse(result) else result,
+                expected.toarray() if scipy.sparse.issparse(expected) else expected,
+            )
+
     @unittest.skipIf(not pybamm.have_jax(), "jax or jaxlib is not installed")
     def test_find_symbols_jax(self):
         # test sparse conversion
@@ -698,6 +854,221 @@ class TestEvaluate(unittest.TestCase):
         with self.assertRaises(NotImplementedError):
             A.multiply(v)
 
+    def test_stable_hash(self):
+        a = pybamm.StateVector(slice(0, 2))
+        A = pybamm.Matrix(scipy.sparse.csr_matrix(np.array([[1, 0], [0, 4]])))
+        expr = A @ pybamm.exp(a) + pybamm.Function(test_function, a)
+        self.assertEqual(stable_hash(expr), stable_hash(expr.create_copy()))
+        self.assertNotEqual(stable_hash(expr), stable_hash(2 * A @ a))
+        self.assertNotEqual(
+            stable_hash(pybamm.StateVector(slice(0, 2))),
+            stable_hash(pybamm.StateVector(slice(1, 3))),
+        )
+
+        # lambda functions are not the same in every session
+        self.assertIsNone(stable_hash(pybamm.Function(lambda x: x, a)))
+
+    def test_evaluator_python_cache(self):
+        class CountingEvaluator(pybamm.EvaluatorPython):
+            generated = 0
+
+            def _generate_code(self, symbol):
+                CountingEvaluator.generated += 1
+                super()._generate_code(symbol)
+
+        a = pybamm.StateVector(slice(0, 2))
+        A = pybamm.Matrix(scipy.sparse.csr_matrix(np.array([[1, 0], [0, 4]])))
+        expr = A @ pybamm.exp(a) * a + pybamm.Function(test_function, a)
+        y = np.array([[2.0], [3.0]])
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            pybamm.settings.evaluator_cache_dir = cache_dir
+            try:
+                # the second evaluator is loaded from the cache
+                for _ in range(2):
+                    evaluator = CountingEvaluator(expr)
+                    np.testing.assert_allclose(evaluator(y=y), expr.evaluate(y=y))
+                self.assertEqual(CountingEvaluator.generated, 1)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+                evaluator = pybamm.EvaluatorPython(expr)
+                evaluator = pickle.loads(pickle.dumps(evaluator))
+                np.testing.assert_allclose(evaluator(y=y), expr.evaluate(y=y))
+
+                # expression trees without a stable hash are not cached
+                expr = pybamm.Function(lambda x: x, a)
+                for _ in range(2):
+                    CountingEvaluator(expr)
+                self.assertEqual(CountingEvaluator.generated, 3)
+                self.assertEqual(len(os.listdir(cache_dir)), 1)
+            finally:
+                pybamm.settings.evaluator_cache_dir = None
+
+    @unittest.skipIf(not pybamm.have_numba(), "numba is not installed")
+    def test_evaluator_numba(self):
+        a = pybamm.StateVector(slice(0, 1))
+        b = pybamm.StateVector(slice(1, 2))
+
+        y_tests = [np.array([[2.0], [3.0]]), np.array([1.0, 3.0])]
+        t_tests = [1.0, 2.0]
+
+        # test dense expressions, which are compiled with numba
+        A = pybamm.Matrix([[1, 2], [3, 4]])
+        for expr in [
+            a * b + b + a ** 2 / b + 2 * a + b / 2 + 4,
+            a * pybamm.t,
+            pybamm.exp(a * b),
+            A @ pybamm.StateVector(slice(0, 2)),
+            pybamm.Vector([1, 2]) <= pybamm.StateVector(slice(0, 2)),
+            pybamm.maximum(pybamm.Vector([1, 2]), pybamm.StateVector(slice(0, 2))),
+            pybamm.NumpyConcatenation(b, a),
+            pybamm.StateVector(slice(0, 1), slice(1, 2)) * b,
+        ]:
+            evaluator = pybamm.EvaluatorNumba(expr)
+            self.assertTrue(evaluator.jittable)
+            for t, y in zip(t_tests, y_tests):
+                result = evaluator(t=t, y=y)
+                np.testing.assert_allclose(result, expr.evaluate(t=t, y=y))
+
+        # test sparse matrices, inputs and python functions fall back to python
+        B = pybamm.Matrix(scipy.sparse.csr_matrix(np.array([[0, 0], [0, 4]])))
+        for expr in [
+            B @ pybamm.StateVector(slice(0, 2)),
+            pybamm.Function(test_function, a),
+            a * pybamm.InputParameter("c"),
+        ]:
+            evaluator = pybamm.EvaluatorNumba(expr)
+            self.assertFalse(evaluator.jittable)
+            for t, y in zip(t_tests, y_tests):
+                result = evaluator(t=t, y=y, inputs={"c": 2})
+                np.testing.assert_allclose(
+                    result, expr.evaluate(t=t, y=y, inputs={"c": 2})
+                )
+
+        # test the jitted function is still used when inputs are passed in
+        expr = a * b
+        evaluator = pybamm.EvaluatorNumba(expr)
+        self.assertEqual(evaluator(y=np.array([[2.0], [3.0]]), inputs={}), 6)
+        self.assertIsInstance(evaluator._evaluate, numba.core.registry.CPUDispatcher)
+
+        # test arguments that numba cannot compile fall back to python
+        y = np.array([[2], [3]], dtype=object)
+        self.assertEqual(evaluator(y=y), 6)
+
+        # test pickling recompiles the function
+        evaluator = pickle.loads(pickle.dumps(evaluator))
+        self.assertEqual(evaluator(y=np.array([[2.0], [3.0]])), 6)
+
+    @unittest.skipIf(not pybamm.have_cython(), "cython is not installed")
+    def test_evaluator_cython(self):
+        a = pybamm.StateVector(slice(0, 1))
+        b = pybamm.StateVector(slice(1, 2))
+
+        y_tests = [np.array([[2.0], [3.0]]), np.array([1.0, 3.0])]
+        t_tests = [1.0, 2.0]
+
+        with tempfile.TemporaryDirectory() as build_dir:
+            # test dense expressions, which are compiled with cython
+            A = pybamm.Matrix([[1, 2], [3, 4]])
+            expr = pybamm.NumpyConcatenation(
+                a * b + b + a ** 2 / b + 2 * a + b / 2 + 4,
+                a * pybamm.t,
+                pybamm.exp(a * b),
+                A @ pybamm.StateVector(slice(0, 2)),
+                pybamm.maximum(pybamm.Vector([1, 2]), pybamm.StateVector(slice(0, 2))),
+            )
+            evaluator = pybamm.EvaluatorCython(expr, build_dir=build_dir)
+            self.assertTrue(evaluator.compilable)
+            for t, y in zip(t_tests, y_tests):
+                result = evaluator(t=t, y=y)
+                np.testing.assert_allclose(result, expr.evaluate(t=t, y=y))
+
+            # test the compiled module is reused, including after pickling
+            n_files = len(os.listdir(build_dir))
+            evaluator = pybamm.EvaluatorCython(expr, build_dir=build_dir)
+            evaluator = pickle.loads(pickle.dumps(evaluator))
+            self.assertEqual(len(os.listdir(build_dir)), n_files)
+            result = evaluator(t=1.0, y=y_tests[0])
+            np.testing.assert_allclose(result, expr.evaluate(t=1.0, y=y_tests[0]))
+
+            # test sparse matrices fall back to python
+            B = pybamm.Matrix(scipy.sparse.csr_matrix(np.array([[0, 0], [0, 4]])))
+            expr = B @ pybamm.StateVector(slice(0, 2))
+            evaluator = pybamm.EvaluatorCython(expr, build_dir=build_dir)
+            self.assertFalse(evaluator.compilable)
+            for t, y in zip(t_tests, y_tests):
+                result = evaluator(t=t, y=y)
+                np.testing.assert_allclose(result, expr.evaluate(t=t, y=y))
+
+            # test a failed build falls back to python
+            build_file = os.path.join(build_dir, "file")
+            open(build_file, "w").close()
+            expr = a * b
+            evaluator = pybamm.EvaluatorCython(expr, build_dir=build_file)
+            self.assertTrue(evaluator.compilable)
+            self.assertIsInstance(evaluator._evaluate, types.FunctionType)
+            self.assertEqual(evaluator(y=np.array([[2.0], [3.0]])), 6)
+
+    @unittest.skipIf(not pybamm.have_symengine(), "symengine is not installed")
+    def test_evaluator_symengine(self):
+        a = pybamm.StateVector(slice(0, 1))
+        b = pybamm.StateVector(slice(1, 2))
+        c = pybamm.StateVector(slice(0, 2))
+
+        y_tests = [np.array([[2.0], [3.0]]), np.array([1.0, 3.0])]
+        t_tests = [1.0, 2.0]
+
+        # test expressions that can be written in symengine, including products with
+        # sparse matrices
+        A = pybamm.Matrix([[1, 2], [3, 4]])
+        B = pybamm.Matrix(scipy.sparse.csr_matrix(np.array([[0, 0], [0, 4]])))
+        for expr in [
+            a * b + b + a ** 2 / b + 2 * a + b / 2 + 4,
+            a * pybamm.t,
+            pybamm.exp(a * b) - pybamm.sqrt(abs(-a)),
+            A @ c,
+            B @ c + c,
+            pybamm.Vector([1, 2]) <= c,
+            pybamm.maximum(pybamm.Vector([1, 2]), c),
+            pybamm.minimum(a, b),
+            pybamm.Index(c, 1),
+            pybamm.NumpyConcatenation(b, a),
+            pybamm.StateVector(slice(0, 1), slice(1, 2)) * b,
+            pybamm.Scalar(3),
+        ]:
+            evaluator = pybamm.EvaluatorSymEngine(expr)
+            self.assertTrue(evaluator.lambdifiable)
+            for t, y in zip(t_tests, y_tests):
+                result = evaluator(t=t, y=y)
+                expected = expr.evaluate(t=t, y=y)
+                self.assertEqual(np.shape(result), np.shape(expected))
+                np.testing.assert_allclose(result, expected)
+
+        # test y with several columns, which are evaluated in turn
+        y = np.array([[2.0, 1.0], [3.0, 4.0]])
+        for expr in [a * b + pybamm.t, A @ c, pybamm.NumpyConcatenation(b, a)]:
+            evaluator = pybamm.EvaluatorSymEngine(expr)
+            self.assertTrue(evaluator.lambdifiable)
+            np.testing.assert_allclose(evaluator(t=2.0, y=y), expr.evaluate(t=2.0, y=y))
+
+        # test sparse results, inputs and python functions fall back to python
+        for expr in [
+            B * pybamm.t,
+            pybamm.Function(test_function, a),
+            a * pybamm.InputParameter("c"),
+        ]:
+            evaluator = pybamm.EvaluatorSymEngine(expr)
+            self.assertFalse(evaluator.lambdifiable)
+            for t, y in zip(t_tests, y_tests):
+                result = evaluator(t=t, y=y, inputs={"c": 2})
+                expected = expr.evaluate(t=t, y=y, inputs={"c": 2})
+                if scipy.sparse.issparse(result):
+                    result, expected = result.toarray(), expected.toarray()
+                np.testing.assert_allclose(result, expected)
+
+        # test pickling recompiles the function
+        evaluator = pickle.loads(pickle.dumps(pybamm.EvaluatorSymEngine(a * b)))
+        self.assertEqual(evaluator(y=np.array([[2.0], [3.0]])), 6)
+
 
 if __name__ == "__main__":
     print("Add -v for more debug output")
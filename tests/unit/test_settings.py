@@ -2,7 +2,9 @@
 # Tests the settings class.
 #
 import pybamm
+import os
 import unittest
+from unittest import mock
 
 
 class TestSettings(unittest.TestCase):
@@ -14,6 +16,37 @@ class TestSettings(unittest.TestCase):
 
         pybamm.settings.simplify = True
 
+    def test_evaluator_cache_dir(self):
+        self.assertIsNone(pybamm.settings.evaluator_cache_dir)
+
+        pybamm.settings.evaluator_cache_dir = "cache"
+        self.assertEqual(pybamm.settings.evaluator_cache_dir, "cache")
+
+        pybamm.settings.evaluator_cache_dir = None
+
+    def test_python_evaluator(self):
+        python_evaluator = pybamm.settings.python_evaluator
+        try:
+            pybamm.settings.python_evaluator = "numba"
+            self.assertEqual(pybamm.settings.python_evaluator, "numba")
+            with self.assertRaisesRegex(ValueError, "python evaluator"):
+                pybamm.settings.python_evaluator = "fortran"
+
+            # the default is read from the environment, and checked
+            pybamm.settings._python_evaluator = None
+            with mock.patch.dict(os.environ, {"PYBAMM_PYTHON_EVALUATOR": "cython"}):
+                self.assertEqual(pybamm.settings.python_evaluator, "cython")
+            pybamm.settings._python_evaluator = None
+            with mock.patch.dict(os.environ, {"PYBAMM_PYTHON_EVALUATOR": "fortran"}):
+                with self.assertRaisesRegex(ValueError, "python evaluator"):
+                    pybamm.settings.python_evaluator
+            pybamm.settings._python_evaluator = None
+            with mock.patch.dict(os.environ):
+                os.environ.pop("PYBAMM_PYTHON_EVALUATOR", None)
+                self.assertEqual(pybamm.settings.python_evaluator, "python")
+        finally:
+            pybamm.settings.python_evaluator = python_evaluator
+
     def test_smoothing_parameters(self):
         self.assertEqual(pybamm.settings.min_smoothing, "exact")
         self.assertEqual(pybamm.settings.max_smoothing, "exact")
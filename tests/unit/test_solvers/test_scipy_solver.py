@@ -4,6 +4,7 @@ import pybamm
 import unittest
 import numpy as np
 from tests import get_mesh_for_testing, get_discretisation_for_testing
+import types
 import warnings
 import sys
 
@@ -48,6 +49,47 @@ class TestScipySolver(unittest.TestCase):
             )
             self.assertEqual(solution.termination, "final time")
 
+    @unittest.skipIf(not pybamm.have_numba(), "numba is not installed")
+    def test_model_solver_python_evaluators(self):
+        # whether each evaluator has compiled the generated code, which must then be
+        # what evaluates the rhs
+        compiled = {
+            "python": lambda evaluator: True,
+            "numba": lambda evaluator: evaluator.jittable
+            and not isinstance(evaluator._evaluate, types.FunctionType),
+            "cython": lambda evaluator: evaluator.compilable
+            and not isinstance(evaluator._evaluate, types.FunctionType),
+            # the lambdified function is called from a closure, unlike the python code
+            "symengine": lambda evaluator: evaluator.lambdifiable
+            and evaluator._evaluate.__closure__ is not None,
+        }
+        evaluators = [
+            name
+            for name in compiled
+            if name == "python" or getattr(pybamm, "have_" + name)()
+        ]
+        python_evaluator = pybamm.settings.python_evaluator
+        try:
+            for name in evaluators:
+                pybamm.settings.python_evaluator = name
+                model = pybamm.BaseModel()
+                model.convert_to_format = "python"
+                domain = ["negative electrode", "separator", "positive electrode"]
+                var = pybamm.Variable("var", domain=domain)
+                model.rhs = {var: 0.1 * var}
+                model.initial_conditions = {var: 1}
+                disc = get_discretisation_for_testing()
+                disc.process_model(model)
+
+                solver = pybamm.ScipySolver(rtol=1e-8, atol=1e-8, method="RK45")
+                t_eval = np.linspace(0, 1, 80)
+                solution = solver.solve(model, t_eval)
+                np.testing.assert_allclose(solution.y[0], np.exp(0.1 * solution.t))
+                self.assertIsInstance(model.rhs_eval, pybamm.EVALUATORS[name])
+                self.assertTrue(compiled[name](model.rhs_eval))
+        finally:
+            pybamm.settings.python_evaluator = python_evaluator
+
     def test_model_solver_failure(self):
         # Turn off warnings to ignore sqrt error
         warnings.simplefilter("ignore")